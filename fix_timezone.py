@@ -7,10 +7,16 @@ and other US timezone formats. It updates the database to use proper PostgreSQL
 timezone names and provides a mapping for the application.
 """
 
+import itertools
+import logging
 import psycopg2
+from psycopg2 import errors
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
 import os
 import sys
-from typing import Dict, List, Tuple
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set
 
 # Database connection parameters
 DB_CONFIG = {
@@ -21,6 +27,11 @@ DB_CONFIG = {
     'password': 'postgres'
 }
 
+logger = logging.getLogger(__name__)
+
+# Upper bound on pooled connections held by a single fixer
+MAX_CONNECTIONS = 8
+
 # Timezone mapping from US format to PostgreSQL format
 TIMEZONE_MAPPING = {
     'US/Central': 'America/Chicago',
@@ -41,133 +52,215 @@ TIMEZONE_MAPPING = {
     'Canada/Yukon': 'America/Whitehorse'
 }
 
+# Timezones that PostgreSQL does not recognize
+INVALID_TIMEZONE_KEYS = tuple(TIMEZONE_MAPPING.keys())
+
+# (old, new) pairs, materialized once for query parameters
+TIMEZONE_ITEMS = tuple(TIMEZONE_MAPPING.items())
+
 class TimezoneFixer:
     def __init__(self, db_config: Dict[str, str]):
         self.db_config = db_config
-        self.connection = None
+        self.pool = None
+        self._tz_test_cache: Dict[str, bool] = {}
+        self._tz_names: Optional[Set[str]] = None
         
     def connect(self):
-        """Establish database connection"""
+        """Open the database connection pool"""
         try:
-            self.connection = psycopg2.connect(**self.db_config)
-            self.connection.autocommit = False
+            self.pool = ThreadedConnectionPool(
+                minconn=1, maxconn=MAX_CONNECTIONS, **self.db_config
+            )
             print("✓ Connected to PostgreSQL database")
             return True
         except psycopg2.Error as e:
-            print(f"✗ Failed to connect to database: {e}")
+            logger.error("✗ Failed to connect to database: %s", e)
             return False
     
     def disconnect(self):
-        """Close database connection"""
-        if self.connection:
-            self.connection.close()
+        """Close all pooled database connections"""
+        if self.pool:
+            self.pool.closeall()
             print("✓ Database connection closed")
     
-    def get_invalid_timezones(self) -> List[Tuple[str, int]]:
-        """Find users with invalid timezone formats"""
-        cursor = self.connection.cursor()
-        
-        query = """
-        SELECT id, timezone 
-        FROM srs_configs 
-        WHERE timezone IN %s
-        """
-        
-        invalid_timezones = list(TIMEZONE_MAPPING.keys())
-        cursor.execute(query, (tuple(invalid_timezones),))
+    @contextmanager
+    def _conn(self):
+        """Borrow a connection from the pool for the duration of a block
         
-        results = cursor.fetchall()
-        cursor.close()
-        
-        return results
+        Any transaction left open on the connection is rolled back when it
+        is returned, so callers must commit the work they want to keep.
+        """
+        conn = self.pool.getconn()
+        try:
+            yield conn
+        finally:
+            self.pool.putconn(conn)
     
     def fix_timezone(self, user_id: str, old_timezone: str) -> bool:
         """Fix timezone for a specific user"""
-        if old_timezone not in TIMEZONE_MAPPING:
-            print(f"⚠ No mapping found for timezone: {old_timezone}")
+        new_timezone = TIMEZONE_MAPPING.get(old_timezone)
+        if new_timezone is None:
+            logger.warning("⚠ No mapping found for timezone: %s", old_timezone)
             return False
         
-        new_timezone = TIMEZONE_MAPPING[old_timezone]
-        cursor = self.connection.cursor()
-        
-        try:
-            # Update the timezone
-            update_query = """
-            UPDATE srs_configs 
-            SET timezone = %s 
-            WHERE id = %s
-            """
-            cursor.execute(update_query, (new_timezone, user_id))
-            
-            # Verify the update
-            verify_query = "SELECT timezone FROM srs_configs WHERE id = %s"
-            cursor.execute(verify_query, (user_id,))
-            result = cursor.fetchone()
-            
-            if result and result[0] == new_timezone:
-                print(f"✓ Updated user {user_id}: {old_timezone} → {new_timezone}")
-                return True
-            else:
-                print(f"✗ Failed to update user {user_id}")
-                return False
+        with self._conn() as conn, conn.cursor() as cursor:
+            try:
+                # Update the timezone
+                update_query = """
+                UPDATE srs_configs 
+                SET timezone = %s 
+                WHERE id = %s
+                RETURNING timezone
+                """
+                cursor.execute(update_query, (new_timezone, user_id))
+                result = cursor.fetchone()
                 
-        except psycopg2.Error as e:
-            print(f"✗ Database error updating user {user_id}: {e}")
-            return False
-        finally:
-            cursor.close()
+                if result and result[0] == new_timezone:
+                    conn.commit()
+                    logger.debug("✓ Updated user %s: %s → %s", user_id, old_timezone, new_timezone)
+                    return True
+                else:
+                    logger.warning("✗ Failed to update user %s", user_id)
+                    return False
+                    
+            except psycopg2.Error as e:
+                logger.error("✗ Database error updating user %s: %s", user_id, e)
+                return False
     
     def fix_all_timezones(self) -> Dict[str, int]:
-        """Fix all invalid timezones in the database"""
+        """Fix all invalid timezones in the database
+        
+        All updates run in a single transaction that is committed only if
+        the statement succeeds. Rows whose mapped target PostgreSQL does not
+        recognize are left unchanged and counted as failed, while every other
+        row is still rewritten and committed.
+        """
         print("🔍 Scanning for invalid timezones...")
         
-        invalid_users = self.get_invalid_timezones()
+        # Per-user rows are only returned when they will actually be logged,
+        # so a large run doesn't pull every updated row into memory
+        log_users = logger.isEnabledFor(logging.DEBUG)
+        returning = "RETURNING s.id, m.old, m.new" if log_users else ""
         
-        if not invalid_users:
-            print("✓ No invalid timezones found")
-            return {"fixed": 0, "failed": 0}
+        # Scan and rewrite in a single statement, joining against the mapping.
+        # Targets PostgreSQL does not know are skipped and reported as failed.
+        update_query = f"""
+        WITH m(old, new) AS (VALUES %s)
+        UPDATE srs_configs s
+        SET timezone = m.new
+        FROM m
+        JOIN pg_timezone_names p ON p.name = m.new
+        WHERE s.timezone = m.old
+        {returning}
+        """
         
-        print(f"Found {len(invalid_users)} users with invalid timezones")
+        with self._conn() as conn, conn.cursor() as cursor:
+            try:
+                # One page, so rowcount covers the whole update
+                updated = execute_values(
+                    cursor, update_query, TIMEZONE_ITEMS,
+                    page_size=len(TIMEZONE_ITEMS), fetch=log_users
+                )
+                fixed_count = cursor.rowcount
+                failed_count = self._count_invalid_timezones(cursor)
+                
+                conn.commit()
+            except psycopg2.Error as e:
+                # Returning the connection to the pool rolls back or discards it
+                logger.error("✗ Database error updating timezones: %s", e)
+                raise
         
-        fixed_count = 0
-        failed_count = 0
+        if not fixed_count and not failed_count:
+            print("✓ No invalid timezones found")
         
-        for user_id, old_timezone in invalid_users:
-            if self.fix_timezone(user_id, old_timezone):
-                fixed_count += 1
-            else:
-                failed_count += 1
+        for user_id, old_timezone, new_timezone in updated or ():
+            logger.debug("✓ Updated user %s: %s → %s", user_id, old_timezone, new_timezone)
         
         return {"fixed": fixed_count, "failed": failed_count}
     
+    @staticmethod
+    def _count_invalid_timezones(cursor) -> int:
+        query = "SELECT count(*) FROM srs_configs WHERE timezone IN %s"
+        cursor.execute(query, (INVALID_TIMEZONE_KEYS,))
+        
+        return cursor.fetchone()[0]
+    
     def test_timezone_query(self, timezone: str) -> bool:
         """Test if a timezone works in PostgreSQL"""
-        cursor = self.connection.cursor()
+        if timezone in self._tz_test_cache:
+            works = self._tz_test_cache[timezone]
+            status = "works correctly" if works else "failed"
+            print(f"{'✓' if works else '✗'} Timezone '{timezone}' {status} (cached)")
+            return works
         
-        try:
-            # Test query similar to the one causing the error
-            test_query = """
-            SELECT date(now() at time zone 'utc' at time zone %s) as test_date
-            """
-            cursor.execute(test_query, (timezone,))
-            result = cursor.fetchone()
-            
-            if result:
-                print(f"✓ Timezone '{timezone}' works correctly")
-                return True
-            else:
-                print(f"✗ Timezone '{timezone}' failed")
-                return False
+        with self._conn() as conn, conn.cursor() as cursor:
+            try:
+                # Test query similar to the one causing the error
+                test_query = """
+                SELECT date(now() at time zone 'utc' at time zone %s) as test_date
+                """
+                cursor.execute(test_query, (timezone,))
+                result = cursor.fetchone()
                 
+                if result:
+                    print(f"✓ Timezone '{timezone}' works correctly")
+                    self._tz_test_cache[timezone] = True
+                    return True
+                else:
+                    logger.warning("✗ Timezone '%s' failed", timezone)
+                    return False
+                    
+            except errors.InvalidParameterValue as e:
+                # PostgreSQL rejected the name itself, which won't change
+                logger.error("✗ Timezone '%s' error: %s", timezone, e)
+                self._tz_test_cache[timezone] = False
+                return False
+            except psycopg2.Error as e:
+                logger.error("✗ Timezone '%s' error: %s", timezone, e)
+                return False
+    
+    def test_timezones_bulk(self, timezones: List[str]) -> Dict[str, bool]:
+        """Look up many canonical timezone names in pg_timezone_names at once
+        
+        This is an exact catalog lookup, not an AT TIME ZONE test: use it for
+        the mapping targets, which are canonical names, not for arbitrary input.
+        """
+        try:
+            known = self._timezone_names()
         except psycopg2.Error as e:
-            print(f"✗ Timezone '{timezone}' error: {e}")
-            return False
-        finally:
-            cursor.close()
+            logger.error("✗ Bulk timezone test error: %s", e)
+            return {}
+        
+        results = {timezone: timezone in known for timezone in timezones}
+        
+        for timezone, works in results.items():
+            if not works:
+                logger.warning("✗ Timezone '%s' is not recognized", timezone)
+        recognized = sum(results.values())
+        if recognized == len(results):
+            print(f"✓ {recognized}/{len(results)} timezones recognized")
+        else:
+            logger.warning("✗ %d/%d timezones recognized", recognized, len(results))
+        
+        return results
+    
+    def _timezone_names(self) -> Set[str]:
+        """Timezone names PostgreSQL recognizes, loaded once per fixer"""
+        if self._tz_names is None:
+            with self._conn() as conn, conn.cursor() as cursor:
+                cursor.execute("SELECT name FROM pg_timezone_names")
+                self._tz_names = {row[0] for row in cursor.fetchall()}
+        
+        return self._tz_names
     
     def generate_timezone_mapping_file(self):
         """Generate a timezone mapping file for the Elixir application"""
-        mapping_content = '''# Timezone mapping for PostgreSQL compatibility
+        for timezone in itertools.chain.from_iterable(TIMEZONE_ITEMS):
+            if '"' in timezone or '\\' in timezone or '#{' in timezone:
+                raise ValueError(f"Timezone {timezone!r} cannot be embedded in an Elixir string")
+        
+        entries = ",\n    ".join(f'"{old}" => "{new}"' for old, new in TIMEZONE_ITEMS)
+        mapping_content = f'''# Timezone mapping for PostgreSQL compatibility
 # This file maps US timezone formats to PostgreSQL-compatible formats
 
 defmodule Memoet.Utils.TimezoneMapping do
@@ -175,24 +268,9 @@ defmodule Memoet.Utils.TimezoneMapping do
   Maps US timezone formats to PostgreSQL-compatible timezone names
   """
   
-  @timezone_mapping %{
-    "US/Central" => "America/Chicago",
-    "US/Eastern" => "America/New_York", 
-    "US/Mountain" => "America/Denver",
-    "US/Pacific" => "America/Los_Angeles",
-    "US/Alaska" => "America/Anchorage",
-    "US/Arizona" => "America/Phoenix",
-    "US/East-Indiana" => "America/Indiana/Indianapolis",
-    "US/Hawaii" => "Pacific/Honolulu",
-    "Canada/Atlantic" => "America/Halifax",
-    "Canada/Central" => "America/Winnipeg",
-    "Canada/Eastern" => "America/Toronto",
-    "Canada/Mountain" => "America/Edmonton",
-    "Canada/Newfoundland" => "America/St_Johns",
-    "Canada/Pacific" => "America/Vancouver",
-    "Canada/Saskatchewan" => "America/Regina",
-    "Canada/Yukon" => "America/Whitehorse"
-  }
+  @timezone_mapping %{{
+    {entries}
+  }}
   
   def normalize_timezone(timezone) do
     Map.get(@timezone_mapping, timezone, timezone)
@@ -204,13 +282,30 @@ defmodule Memoet.Utils.TimezoneMapping do
 end
 '''
         
-        with open('/home/hnat/services/memoet/lib/memoet/utils/timezone_mapping.ex', 'w') as f:
-            f.write(mapping_content)
+        mapping_path = '/home/hnat/services/memoet/lib/memoet/utils/timezone_mapping.ex'
+        new_content = mapping_content.encode()
+        
+        # Leave an up-to-date file untouched so Elixir doesn't recompile it
+        try:
+            with open(mapping_path, 'rb') as f:
+                if f.read() == new_content:
+                    print("✓ Mapping file unchanged: lib/memoet/utils/timezone_mapping.ex")
+                    return
+        except FileNotFoundError:
+            pass
+        
+        with open(mapping_path, 'wb') as f:
+            f.write(new_content)
         
         print("✓ Generated timezone mapping file: lib/memoet/utils/timezone_mapping.ex")
 
 def main():
     """Main function to run the timezone fix"""
+    # LOG_LEVEL=DEBUG lists every updated user
+    logging.basicConfig(
+        level=os.getenv('LOG_LEVEL', 'INFO').upper(), format="%(message)s", stream=sys.stdout
+    )
+    
     print("🔧 PostgreSQL Timezone Fix Tool for Memoet")
     print("=" * 50)
     
@@ -222,8 +317,7 @@ def main():
     try:
         # Test current problematic timezone
         print("\n🧪 Testing timezone compatibility...")
-        fixer.test_timezone_query("US/Central")
-        fixer.test_timezone_query("America/Chicago")
+        fixer.test_timezones_bulk(list(TIMEZONE_MAPPING.values()))
         
         # Fix all invalid timezones
         print("\n🔧 Fixing invalid timezones...")